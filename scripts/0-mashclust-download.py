@@ -222,7 +222,7 @@ def main():
                     if filename.endswith('assembly_data_report.jsonl'):
                         with z.open(filename) as f:
                             for line in f:
-                                data = json.loads(line.decode('utf-8'))
+                                data = json.loads(line)
                                 acc = data.get('accession')
                                 if acc:
                                     genome_meta[acc] = {
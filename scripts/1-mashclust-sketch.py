@@ -5,9 +5,31 @@ Updated to support 'Cluster All' mode via --no-filter.
 """
 import subprocess
 import sys
+import os
 import argparse
 from pathlib import Path
 
+def scan_genomes(root):
+    """
+    Recursively yields (parent_folder_name_lowercase, path) for every GENOME_*.fna
+    under root. Uses os.scandir and lowercases each folder name once.
+    Same order as Path.rglob (a folder's files, then its subfolders, preorder),
+    since it sets the Mash label order.
+    """
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        folder_lc = os.path.basename(folder).lower()
+        subdirs = []
+        with os.scandir(folder) as it:
+            for entry in it:
+                # Like Path.rglob: symlinked directories are not descended into
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.name.startswith('GENOME_') and entry.name.endswith('.fna'):
+                    yield folder_lc, entry.path
+        stack.extend(reversed(subdirs))
+
 def main():
     # 1. Argument Parsing
     parser = argparse.ArgumentParser(description="Step 1: Sketch and Filter")
@@ -42,14 +64,13 @@ def main():
     
     # 2. Categorizing Genomes
     # We search for .fna files recursively
-    for genome_file in base_path.rglob("GENOME_*.fna"):
-        # Parent folder name (e.g., staphylococcus_aureus_GCF...)
-        parent_folder = genome_file.parent.name.lower()
-        
+    filter_lc = args.filter.lower() if args.filter else None
+    for parent_folder, genome_file in scan_genomes(str(base_path)):
+        # parent_folder: lowercased folder name (e.g., staphylococcus_aureus_gcf...)
         if args.no_filter:
             # Mode: Cluster everything
             target_genomes.append(genome_file)
-        elif args.filter and parent_folder.startswith(args.filter.lower()):
+        elif filter_lc and parent_folder.startswith(filter_lc):
             # Mode: Filter by name
             target_genomes.append(genome_file)
         else:
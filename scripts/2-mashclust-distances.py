@@ -5,8 +5,116 @@ Script 2: Calculate Distances (Zero-RAM Streaming Version)
 import subprocess
 import sys
 import argparse
+import gzip
+import itertools
+import os
+import shutil
 import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+import numpy as np
+
+# Upper bound on the text matrix bytes handed to one parse task (RAM stays flat in N)
+PARSE_BLOCK_BYTES = 64 << 20
+
+# condensed_offset / open_matrix are kept identical in scripts 2, 3 and 4 (standalone scripts)
+def condensed_offset(i, n):
+    """Index in the condensed upper triangle where row i (pairs i < j) starts"""
+    return i * (2 * n - i - 1) // 2
+
+def open_matrix(path, mode='rt'):
+    """Opens distances.txt, or distances.txt.gz through gzip"""
+    return gzip.open(path, mode) if str(path).endswith('.gz') else open(path, mode)
+
+def _write_rows(condensed, lines, n, first_row):
+    """Parses matrix rows (bytes) and stores their upper-triangle part; returns the row count"""
+    k = 0
+    for k, line in enumerate(lines, 1):
+        i = first_row + k - 1
+        rest = line.split(b'\t', 1)[1]
+        row = np.fromstring(rest, sep='\t', dtype=np.float32, count=n)
+        off = condensed_offset(i, n)
+        condensed[off:off + n - i - 1] = row[i + 1:]
+    return k
+
+def _parse_rows(dist_file, npy_file, n, first_row, start, n_rows):
+    """Worker: parses `n_rows` rows of distances.txt from byte `start`, line by line, into its slice of the .npy"""
+    condensed = np.load(npy_file, mmap_mode='r+')
+    with open(dist_file, 'rb') as f:
+        f.seek(start)
+        rows = _write_rows(condensed, itertools.islice(f, n_rows), n, first_row)
+    condensed.flush()
+    return rows
+
+def write_labels(dist_file, out_dir):
+    """Writes the matrix header to labels.txt (one genome label per line) and returns the labels"""
+    with open_matrix(dist_file) as f:
+        labels = [p.strip() for p in f.readline().strip().split('\t')[1:]]
+    (out_dir / "labels.txt").write_text('\n'.join(labels) + '\n')
+    return labels
+
+def materialize_matrix(dist_file, out_dir, n, threads=1):
+    """
+    One-shot conversion of the Mash text matrix (N genomes) into a float32
+    distances_condensed.npy, memory-mappable by scripts 3 and 4.
+    The matrix is symmetric, so only the upper
+    triangle is stored, flattened row by row as in scipy's squareform
+    (N*(N-1)/2 values; pair i < j lives at condensed_offset(i, N) + j - i - 1).
+    The file is split on row boundaries into blocks of at most PARSE_BLOCK_BYTES,
+    parsed line by line by a pool of processes, each writing its rows straight
+    into the on-disk array. A gzip-compressed
+    matrix cannot be split, so it is parsed serially as a stream.
+    """
+    npy_file = out_dir / "distances_condensed.npy"
+    tmp_file = out_dir / "distances_condensed.npy.tmp"
+
+    if str(dist_file).endswith('.gz'):
+        condensed = np.lib.format.open_memmap(tmp_file, mode='w+', dtype=np.float32,
+                                              shape=(n * (n - 1) // 2,))
+        with open_matrix(dist_file, 'rb') as f:
+            f.readline()
+            rows = _write_rows(condensed, f, n, 0)
+        condensed.flush()
+        del condensed
+        if rows != n:
+            raise ValueError(f"Matrix has {rows} rows but {n} columns")
+        os.replace(tmp_file, npy_file)
+        return npy_file
+
+    with open(dist_file, 'rb') as f:
+        # Row start offsets from a single streamed pass (the header line is skipped)
+        pos = len(f.readline())
+        offsets = [pos]
+        for line in f:
+            pos += len(line)
+            offsets.append(pos)
+        size = pos
+
+    if len(offsets) - 1 != n:
+        raise ValueError(f"Matrix has {len(offsets) - 1} rows but {n} columns")
+
+    condensed = np.lib.format.open_memmap(tmp_file, mode='w+', dtype=np.float32,
+                                          shape=(n * (n - 1) // 2,))
+    del condensed
+
+    # Row blocks of at most PARSE_BLOCK_BYTES (and ~4 per worker on small matrices
+    # to balance the load); a block always holds at least one row
+    block_bytes = min(PARSE_BLOCK_BYTES, -(-(size - offsets[0]) // max(1, threads * 4)))
+    blocks = []
+    r0 = 0
+    for r in range(1, n + 1):
+        if r == n or offsets[r + 1] - offsets[r0] > block_bytes:
+            blocks.append((r0, offsets[r0], r - r0))
+            r0 = r
+
+    with ProcessPoolExecutor(max_workers=threads) as ex:
+        futures = [ex.submit(_parse_rows, dist_file, tmp_file, n, r0, start, n_rows)
+                   for r0, start, n_rows in blocks]
+        for fut in futures:
+            fut.result()
+
+    os.replace(tmp_file, npy_file)
+    return npy_file
 
 def main():
     # 1. Argument Parsing
@@ -15,6 +123,7 @@ def main():
     parser.add_argument("-o", "--output-dir", required=True)
     parser.add_argument("--threads", type=int, default=1)
     parser.add_argument("--chunk-size", type=int, default=2000, help="Compatibility flag")
+    parser.add_argument("--compress", action="store_true", help="Write distances.txt.gz (pigz if available, else gzip)")
     args = parser.parse_args()
 
     # 2. Setup Paths
@@ -23,7 +132,7 @@ def main():
     input_dir = Path(args.input_dir)
 
     sketch_path = input_dir / "genomes_sketch.msh"
-    dist_file = out_dir / "distances.txt"
+    dist_file = out_dir / ("distances.txt.gz" if args.compress else "distances.txt")
 
     if not sketch_path.exists():
         print(f"[ERROR] Sketch file not found: {sketch_path}")
@@ -43,6 +152,9 @@ def main():
     print(f"[INFO] Starting calculation (All-vs-All)")
     print(f"[INFO] Threads: {args.threads}")
     print(f"[INFO] Output:  {dist_file}")
+    if args.compress:
+        compressor = ["pigz", "-p", str(args.threads), "-c"] if shutil.which("pigz") else ["gzip", "-c"]
+        print(f"[INFO] Compression: {compressor[0]}")
     print(f"[INFO] Logic:   Streaming directly to disk to bypass Python RAM limits.")
     print("-" * 60)
 
@@ -51,19 +163,44 @@ def main():
     try:
         # We open the file and pass the handle directly to the subprocess.
         # This ensures Mash writes to the disk and Python never sees the data.
-        with open(dist_file, "w") as f_out:
-            result = subprocess.run(
-                cmd, 
-                stdout=f_out, 
-                stderr=subprocess.PIPE, 
-                text=True,
-                check=True
-            )
-            
+        with open(dist_file, "wb") as f_out:
+            if args.compress:
+                # Mash -> compressor -> disk; the compressor runs in parallel with Mash
+                gz = subprocess.Popen(compressor, stdin=subprocess.PIPE, stdout=f_out)
+                try:
+                    result = subprocess.run(
+                        cmd,
+                        stdout=gz.stdin,
+                        stderr=subprocess.PIPE,
+                        text=True,
+                        check=True
+                    )
+                finally:
+                    gz.stdin.close()
+                    gz.wait()
+                if gz.returncode != 0:
+                    raise RuntimeError(f"{compressor[0]} exited with code {gz.returncode}")
+            else:
+                result = subprocess.run(
+                    cmd,
+                    stdout=f_out,
+                    stderr=subprocess.PIPE,
+                    text=True,
+                    check=True
+                )
+
+
         duration = time.time() - start_time
         print(f"[SUCCESS] Calculation finished in {duration/60:.2f} minutes.")
         print(f"[SUCCESS] Matrix saved to {dist_file}")
 
+        # 5. Labels and binary sidecar for downstream steps
+        labels = write_labels(dist_file, out_dir)
+        start_time = time.time()
+        npy_file = materialize_matrix(dist_file, out_dir, len(labels), args.threads)
+        duration = time.time() - start_time
+        print(f"[SUCCESS] Binary matrix saved to {npy_file} ({duration:.1f}s)")
+
     except subprocess.CalledProcessError as e:
         print(f"[ERROR] Mash dist failed.")
         print(f"[ERROR] Stderr output: {e.stderr}")
@@ -4,31 +4,164 @@ Script 3: Cluster Genomes and Select Representatives (Multi-Reference Support)
 """
 import sys
 import argparse
+import gzip
 import json
 import numpy as np
 import re
+from functools import lru_cache
 from pathlib import Path
-from collections import defaultdict
+from scipy.sparse import csr_matrix
 
+# Optional JIT for the greedy clustering loop
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    print("[WARNING] Numba not found. Greedy clustering will run without JIT.")
+
+# Regex: [._] matches either dot or underscore before version
+_GC_RE = re.compile(r'(GC[FA]_\d{9}[._]\d+)')
+
+@lru_cache(maxsize=None)
 def extract_genome_id(path_str):
     """Extract clean ID (GCF/GCA) or fallback to folder name"""
-    path = Path(path_str)
-    # Regex changed: [._] matches either dot or underscore before version
-    match = re.search(r'(GC[FA]_\d{9}[._]\d+)', path.name)
+    head, _, name = path_str.rpartition('/')
+    parent_name = head.rpartition('/')[2]
+    match = _GC_RE.search(name)
     if match: return match.group(1)
     # Attempt 2: Parent folder name
-    match = re.search(r'(GC[FA]_\d{9}[._]\d+)', path.parent.name)
+    match = _GC_RE.search(parent_name)
     if match: return match.group(1)
     # Fallback
-    return path.parent.name
+    return parent_name
 
 def normalize_id(acc_id):
     """Normalize Accession ID by replacing dots with underscores."""
     return acc_id.replace('.', '_')
 
+def open_matrix(path, mode='rt'):
+    """Opens distances.txt, or distances.txt.gz through gzip"""
+    return gzip.open(path, mode) if str(path).endswith('.gz') else open(path, mode)
+
+# read_labels / sidecar_fresh are kept identical in scripts 3 and 4 (open_matrix also in script 2)
+# (standalone scripts), so both read the labels and the .npy under the same rules
+def sidecar_fresh(sidecar, dist_file):
+    """True if a file written by script 2 next to the matrix is usable: present and not older than the matrix"""
+    return sidecar.exists() and (not dist_file.exists()
+                                 or sidecar.stat().st_mtime >= dist_file.stat().st_mtime)
+
+def read_labels(dist_file):
+    """Genome labels (matrix column order): labels.txt from script 2, else the matrix header"""
+    labels_file = dist_file.parent / "labels.txt"
+    if sidecar_fresh(labels_file, dist_file):
+        return labels_file.read_text().splitlines()
+    with open_matrix(dist_file) as f:
+        return [p.strip() for p in f.readline().strip().split('\t')[1:]]
+
+def iter_text_rows(f, n_genomes):
+    """Yields (row_index, 1 x N float64 block) for each row of an open distances.txt"""
+    i = 0
+    for line in f:
+        _, sep, rest = line.partition('\t')
+        if not sep: continue
+        yield i, np.fromstring(rest, sep='\t', dtype=np.float64, count=n_genomes)[np.newaxis]
+        i += 1
+
+def float32_cutoff(distance_threshold):
+    """
+    Largest float32 whose shortest repr (the decimal read from distances.txt) is
+    <= distance_threshold, so the float32 .npy gives the same pairs as the
+    float64 comparison on the text matrix (the repr is monotone in the value).
+    """
+    thr = np.float32(distance_threshold)
+    while float(str(thr)) > distance_threshold:
+        thr = np.nextafter(thr, np.float32(-np.inf))
+    while float(str(np.nextafter(thr, np.float32(np.inf)))) <= distance_threshold:
+        thr = np.nextafter(thr, np.float32(np.inf))
+    return thr
+
+# Kept identical to condensed_offset in script 2 (standalone scripts)
+def condensed_offset(i, n):
+    """Index in the condensed upper triangle where row i (pairs i < j) starts"""
+    return i * (2 * n - i - 1) // 2
+
+def threshold_condensed_pairs(condensed, n, distance_threshold, block_rows=256):
+    """
+    Returns the (i, j) index arrays of pairs with i < j and distance <= threshold
+    from the memory-mapped upper-triangle vector written by script 2.
+    Rows are scanned in blocks, each a contiguous slice of the vector.
+    """
+    thr = float32_cutoff(distance_threshold)
+    i_parts, j_parts = [], []
+    for r0 in range(0, n - 1, block_rows):
+        r1 = min(r0 + block_rows, n - 1)
+        offs = condensed_offset(np.arange(r0, r1 + 1, dtype=np.int64), n)
+        ks = np.flatnonzero(np.asarray(condensed[offs[0]:offs[-1]]) <= thr) + offs[0]
+        ii = np.searchsorted(offs, ks, side='right') - 1
+        jj = ks - offs[ii] + (ii + r0) + 1
+        i_parts.append(ii + r0)
+        j_parts.append(jj)
+    if not i_parts:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    return np.concatenate(i_parts), np.concatenate(j_parts)
+
+def threshold_upper_pairs(row_blocks, distance_threshold):
+    """
+    Returns the (i, j) index arrays of pairs with i < j and distance <= threshold.
+    The matrix is symmetric, so only the upper triangle is kept (this also
+    drops the self-distance diagonal).
+    """
+    thr = np.float64(distance_threshold)
+    i_parts, j_parts = [], []
+    for start, block in row_blocks:
+        ii, jj = np.nonzero(block <= thr)
+        ii += start
+        keep = jj > ii
+        i_parts.append(ii[keep])
+        j_parts.append(jj[keep])
+    if not i_parts:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    return np.concatenate(i_parts), np.concatenate(j_parts)
+
+def _greedy_cluster_ids_kernel(indptr, indices, order):
+    """Greedy pass over CSR arrays; returns each genome's cluster id (ids follow seed order)"""
+    cluster_ids = np.full(len(order), -1, np.int32)
+    cid = 0
+    for k in range(len(order)):
+        g = order[k]
+        if cluster_ids[g] >= 0:
+            continue
+        cluster_ids[g] = cid
+        for p in range(indptr[g], indptr[g + 1]):
+            nb = indices[p]
+            if cluster_ids[nb] < 0:
+                cluster_ids[nb] = cid
+        cid += 1
+    return cluster_ids
+
+if NUMBA_AVAILABLE:
+    _greedy_cluster_ids_kernel = njit(cache=True)(_greedy_cluster_ids_kernel)
+
+def greedy_cluster_ids(indptr, indices, order):
+    """Greedy clustering: each unassigned seed (in `order`) claims its unassigned neighbors"""
+    if NUMBA_AVAILABLE:
+        return _greedy_cluster_ids_kernel(indptr, indices, order)
+    # NumPy fallback: Python loop over seeds, vectorized over neighbors
+    cluster_ids = np.full(len(order), -1, np.int32)
+    cid = 0
+    for g in order:
+        if cluster_ids[g] >= 0:
+            continue
+        nb = indices[indptr[g]:indptr[g + 1]]
+        cluster_ids[nb[cluster_ids[nb] < 0]] = cid
+        cluster_ids[g] = cid
+        cid += 1
+    return cluster_ids
+
 def main():
     parser = argparse.ArgumentParser(description="Step 3: Cluster Genomes")
-    parser.add_argument("input_dir", help="Directory with distances.txt or distances.txt file")
+    parser.add_argument("input_dir", help="Directory with distances.txt(.gz) or the distance file itself")
     parser.add_argument("-o", "--output", required=True, help="Output file (representatives.txt)")
     parser.add_argument("-t", "--threshold", type=float, default=0.9997)
     parser.add_argument("-n", "--num-representatives", type=int, default=5)
@@ -44,6 +177,8 @@ def main():
     # Identify distances.txt location
     input_path = Path(args.input_dir)
     dist_file = input_path if input_path.is_file() else input_path / "distances.txt"
+    if not dist_file.exists() and input_path.is_dir():
+        dist_file = input_path / "distances.txt.gz"
 
     if not dist_file.exists():
         print(f"[ERROR] Distance file not found at: {dist_file}")
@@ -52,42 +187,43 @@ def main():
     print(f"[INFO] Threshold: {args.threshold} | Max Reps: {args.num_representatives}")
     
     # 1. Parse Distance Matrix
-    neighbors = defaultdict(set)
     genome_paths = {} # Map ID -> Full Path
     
     distance_threshold = 1.0 - args.threshold
     
-    print("[INFO] Parsing distance matrix...")
-    with open(dist_file, 'r') as f:
-        # Read header
-        header = f.readline().strip().split('\t')[1:]
-        all_genomes_list = [p.strip() for p in header]
-        
-        # Map IDs to paths
-        for p in all_genomes_list:
-            gid = extract_genome_id(p)
-            genome_paths[gid] = p
-            
-        genome_ids_ordered = list(genome_paths.keys())
+    # Binary sidecar written by script 2 (skipped if older than the text matrix)
+    npy_file = dist_file.parent / "distances_condensed.npy"
+    use_npy = sidecar_fresh(npy_file, dist_file)
 
-        # Read rows
-        for i, line in enumerate(f):
-            parts = line.strip().split('\t')
-            if len(parts) < 2: continue
-            
-            query_id = extract_genome_id(parts[0])
-            dists = parts[1:]
-            
-            for j, d_str in enumerate(dists):
-                try:
-                    d = float(d_str)
-                    target_id = genome_ids_ordered[j]
-                    
-                    if query_id != target_id and d <= distance_threshold:
-                        neighbors[query_id].add(target_id)
-                        neighbors[target_id].add(query_id)
-                except ValueError:
-                    continue
+    if use_npy:
+        print(f"[INFO] Loading memory-mapped distance matrix: {npy_file}")
+    else:
+        print("[INFO] Parsing distance matrix...")
+    all_genomes_list = read_labels(dist_file)
+
+    # Map IDs to paths (column j of the matrix -> genome_ids_ordered[j])
+    genome_ids_ordered = [extract_genome_id(p) for p in all_genomes_list]
+    for gid, p in zip(genome_ids_ordered, all_genomes_list):
+        genome_paths[gid] = p
+    n_genomes = len(genome_ids_ordered)
+
+    # Rows are parsed/read as float32 and thresholded block by block,
+    # so the N x N matrix is never held in RAM.
+    if use_npy:
+        condensed = np.load(npy_file, mmap_mode='r')
+        i_idx, j_idx = threshold_condensed_pairs(condensed, n_genomes, distance_threshold)
+        del condensed
+    else:
+        with open_matrix(dist_file) as f:
+            f.readline()
+            i_idx, j_idx = threshold_upper_pairs(iter_text_rows(f, n_genomes), distance_threshold)
+
+    # Adjacency as a symmetric boolean CSR matrix over genome indices
+    adjacency = csr_matrix(
+        (np.ones(2 * len(i_idx), dtype=bool),
+         (np.concatenate((i_idx, j_idx)), np.concatenate((j_idx, i_idx)))),
+        shape=(n_genomes, n_genomes)
+    )
 
     # 2. Identify References (Improved with normalization)
     ref_ids = set()
@@ -106,81 +242,52 @@ def main():
 
     # 3. Greedy Clustering
     print("[INFO] Running Greedy Clustering...")
-    clusters = []
-    assigned = set()
     
     # Sort genomes: References first (forced), then by connectivity
-    genome_connectivity = [(g, len(neighbors[g])) for g in genome_paths.keys()]
+    connectivity = adjacency.getnnz(axis=1)
+    order = np.argsort(-connectivity, kind='stable')
     
+    is_ref = np.isin(genome_ids_ordered, list(ref_ids))
     if ref_ids:
-        refs = [x for x in genome_connectivity if x[0] in ref_ids]
-        others = [x for x in genome_connectivity if x[0] not in ref_ids]
-        refs.sort(key=lambda x: x[1], reverse=True)
-        others.sort(key=lambda x: x[1], reverse=True)
-        genome_connectivity = refs + others
-        print(f"[INFO] {len(refs)} references prioritized in clustering queue.")
-    else:
-        genome_connectivity.sort(key=lambda x: x[1], reverse=True)
+        order = np.concatenate((order[is_ref[order]], order[~is_ref[order]]))
+        print(f"[INFO] {int(is_ref.sum())} references prioritized in clustering queue.")
 
-    for g, _ in genome_connectivity:
-        if g in assigned:
-            continue
-            
-        cluster = {g}
-        assigned.add(g)
-        
-        for neighbor in neighbors[g]:
-            if neighbor not in assigned:
-                cluster.add(neighbor)
-                assigned.add(neighbor)
-        
-        clusters.append(cluster)
+    indptr, indices = adjacency.indptr, adjacency.indices
+    cluster_ids = greedy_cluster_ids(indptr, indices, order)
+
+    # Group genome indices by cluster id
+    members = np.argsort(cluster_ids, kind='stable')
+    clusters = np.split(members, np.cumsum(np.bincount(cluster_ids))[:-1])
 
     print(f"[INFO] Created {len(clusters)} clusters.")
 
     # 4. Select Representatives
-    representatives = []
-    np.random.seed(42) # Reproducibility
-    
-    for cluster in clusters:
-        cluster_list = list(cluster)
-        
-        if len(cluster_list) <= args.num_representatives:
-            representatives.extend(cluster_list)
-        else:
-            selected = []
-            pool = list(cluster_list)
-            
-            if ref_ids:
-                refs_in_cluster = [m for m in pool if m in ref_ids]
-                for r in refs_in_cluster:
-                    selected.append(r)
-                    pool.remove(r)
-                    if len(selected) >= args.num_representatives:
-                        break
-            
-            slots_left = args.num_representatives - len(selected)
-            if slots_left > 0:
-                picked = np.random.choice(pool, size=slots_left, replace=False)
-                selected.extend(picked)
-            
-            representatives.extend(selected)
+    # One pass over all genomes: within each cluster, references come first,
+    # then the rest in a random order; the first N of each cluster are kept.
+    rng = np.random.default_rng(42) # Reproducibility
+    random_keys = rng.random(n_genomes)
+    ranked = np.lexsort((random_keys, ~is_ref, cluster_ids))
+    sorted_ids = cluster_ids[ranked]
+    cluster_starts = np.searchsorted(sorted_ids, sorted_ids)
+    rank_in_cluster = np.arange(n_genomes) - cluster_starts
+    representatives = ranked[rank_in_cluster < args.num_representatives]
 
     # 5. Output
     # A) Representatives list (Writes to the exact file Snakemake wants)
     with open(out_file, "w") as f:
         for r in representatives:
-            f.write(f"{genome_paths[r]}\n")
+            f.write(f"{all_genomes_list[r]}\n")
             
-    # B) JSON data (In the same folder as representatives.txt)
+    # B) Clustering sidecar (In the same folder as representatives.txt)
+    # Adjacency CSR + cluster ids as arrays; genome k of the arrays is labels[k]
+    np.savez_compressed(out_dir / "clustering.npz",
+                        indptr=indptr, indices=indices, cluster_ids=cluster_ids)
     json_path = out_dir / "clustering_data.json"
     json_data = {
-        'clusters': [list(c) for c in clusters],
-        'neighbors': {k: list(v) for k, v in neighbors.items()},
-        'genome_names': genome_paths,
+        'labels': all_genomes_list,
         'identity_threshold': args.threshold
     }
-    
+
     with open(json_path, "w") as f:
         json.dump(json_data, f)
         
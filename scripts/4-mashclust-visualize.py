@@ -4,10 +4,11 @@ Script 4: Cluster Heatmap Visualization with Specific Color Scale
 Blue Limit: 0.06 | Gradual transition to 0.07 (Yellow) | Red: 0.1
 Maintains ALL original functionalities (Quicktree, MDS, Plots).
 """
-import json
 import argparse
+import gzip
 import sys
 import subprocess
+from functools import lru_cache
 from pathlib import Path
 import numpy as np
 
@@ -23,41 +24,98 @@ except ImportError:
 # Try analysis imports
 try:
     from scipy.cluster.hierarchy import linkage, leaves_list, dendrogram
-    from scipy.spatial.distance import squareform
-    from sklearn.manifold import MDS
+    from scipy.linalg import eigh
     ANALYSIS_LIBS_AVAILABLE = True
 except ImportError:
     ANALYSIS_LIBS_AVAILABLE = False
-    print("[WARNING] Scipy or Scikit-learn not found.")
+    print("[WARNING] Scipy not found.")
 
+@lru_cache(maxsize=None)
 def extract_genome_name(path_str):
-    return Path(path_str).parent.name
+    """Parent folder name of a genome path (same as Path(path_str).parent.name)"""
+    return path_str.rpartition('/')[0].rpartition('/')[2]
+
+def condensed_subblock(condensed, n, indices):
+    """Square float32 sub-matrix for the sorted `indices` of an N x N condensed upper triangle"""
+    r = len(indices)
+    iu = np.triu_indices(r, k=1)
+    a, b = indices[iu[0]].astype(np.int64), indices[iu[1]].astype(np.int64)
+    sub = np.zeros((r, r), dtype=np.float32)
+    sub[iu] = condensed[a * (2 * n - a - 1) // 2 + (b - a - 1)]
+    return sub + sub.T
+
+def classical_mds(matrix, n_components=2):
+    """Classical MDS (PCoA): top eigenvectors of the double-centered squared-distance matrix"""
+    d2 = np.square(matrix, dtype=np.float64)
+    # B = -0.5 * J @ D2 @ J with J = I - 1/n, done with row/column means instead of matmuls
+    row_mean = d2.mean(axis=1)
+    b = -0.5 * (d2 - row_mean[:, np.newaxis] - row_mean[np.newaxis, :] + row_mean.mean())
+    n = len(b)
+    w, v = eigh(b, subset_by_index=[n - n_components, n - 1])
+    return v[:, ::-1] * np.sqrt(np.maximum(w[::-1], 0))
+
+def open_matrix(path, mode='rt'):
+    """Opens distances.txt, or distances.txt.gz through gzip"""
+    return gzip.open(path, mode) if str(path).endswith('.gz') else open(path, mode)
+
+# read_labels / sidecar_fresh are kept identical in scripts 3 and 4 (open_matrix also in script 2)
+# (standalone scripts), so both read the labels and the .npy under the same rules
+def sidecar_fresh(sidecar, dist_file):
+    """True if a file written by script 2 next to the matrix is usable: present and not older than the matrix"""
+    return sidecar.exists() and (not dist_file.exists()
+                                 or sidecar.stat().st_mtime >= dist_file.stat().st_mtime)
+
+def read_labels(dist_file):
+    """Genome labels (matrix column order): labels.txt from script 2, else the matrix header"""
+    labels_file = dist_file.parent / "labels.txt"
+    if sidecar_fresh(labels_file, dist_file):
+        return labels_file.read_text().splitlines()
+    with open_matrix(dist_file) as f:
+        return [p.strip() for p in f.readline().strip().split('\t')[1:]]
+
+def load_representative_matrix(dist_file, rep_set):
+    """
+    Reads the representative rows/columns of the distance matrix into a float32 matrix.
+    Uses the memory-mapped distances_condensed.npy from script 2 when present; otherwise
+    parses distances.txt, skipping non-representative rows without parsing them.
+    """
+    dist_file = Path(dist_file)
+    npy_file = dist_file.parent / "distances_condensed.npy"
+    use_npy = sidecar_fresh(npy_file, dist_file)
+    header = read_labels(dist_file)
+    indices = np.array([i for i, h in enumerate(header) if extract_genome_name(h) in rep_set], dtype=np.intp)
+    labels = [extract_genome_name(header[i]) for i in indices]
+    if use_npy:
+        condensed = np.load(npy_file, mmap_mode='r')
+        return labels, condensed_subblock(condensed, len(header), indices)
+
+    with open_matrix(dist_file) as f:
+        f.readline()
+        matrix = np.empty((len(indices), len(indices)), dtype=np.float32)
+        r = 0
+        for line in f:
+            name, _, rest = line.partition('\t')
+            if rest and extract_genome_name(name) in rep_set:
+                matrix[r] = np.fromstring(rest, sep='\t', dtype=np.float32, count=len(header))[indices]
+                r += 1
+    return labels, matrix[:r]
 
 def generate_quicktree(output_dir, dist_file, representatives_file):
     if not Path(representatives_file).exists(): return
     rep_names = [extract_genome_name(line.strip()) for line in open(representatives_file) if line.strip()]
     rep_set = set(rep_names)
 
-    dist_path = Path(dist_file)
-    genome_order = []
-    distance_matrix = []
-
-    with open(dist_path, 'r') as f:
-        header = f.readline().strip().split('\t')[1:]
-        rep_indices = [i for i, path in enumerate(header) if extract_genome_name(path) in rep_set]
-        for line in f:
-            parts = line.strip().split('\t')
-            if extract_genome_name(parts[0]) in rep_set:
-                genome_order.append(extract_genome_name(parts[0]))
-                distance_matrix.append([float(parts[i+1]) for i in rep_indices])
+    genome_order, distance_matrix = load_representative_matrix(dist_file, rep_set)
 
     phylip_file = output_dir / "representatives_phylip.dist"
     n = len(genome_order)
-    with open(phylip_file, 'w') as f:
-        f.write(f"{n}\n")
-        for i, name in enumerate(genome_order):
-            dists_str = '\t'.join(f"{d:.6f}" for d in distance_matrix[i])
-            f.write(f"{name}\t{dists_str}\n")
+    # Name column + sub-block, formatted row by row by numpy. Each float32 goes
+    # through its shortest repr (the decimal read from the matrix) to float64,
+    # so %.6f rounds exactly as it did on the float64-parsed text.
+    rows = np.empty((n, n + 1), dtype=object)
+    rows[:, 0] = genome_order
+    rows[:, 1:] = distance_matrix.astype(str).astype(np.float64)
+    np.savetxt(phylip_file, rows, fmt=['%s'] + ['%.6f'] * n, delimiter='\t', header=str(n), comments='')
 
     tree_file = output_dir / "representatives_tree.nwk"
     try:
@@ -66,13 +124,11 @@ def generate_quicktree(output_dir, dist_file, representatives_file):
             subprocess.run(cmd, check=True, stdout=f_out, stderr=subprocess.PIPE)
     except Exception: pass
 
-def create_plots(data, output_dir):
+def create_plots(cluster_sizes, output_dir):
     if not PLOTLY_AVAILABLE: return
-    clusters = data['clusters']
-    cluster_sizes = [len(c) for c in clusters]
     fig = make_subplots(rows=1, cols=2, subplot_titles=('Cluster Sizes', 'Cumulative'))
     fig.add_trace(go.Histogram(x=cluster_sizes, marker_color='steelblue'), row=1, col=1)
-    sorted_sizes = sorted(cluster_sizes, reverse=True)
+    sorted_sizes = np.sort(cluster_sizes)[::-1]
     fig.add_trace(go.Scatter(y=np.cumsum(sorted_sizes), mode='lines'), row=1, col=2)
     fig.write_html(output_dir / "cluster_distribution.html")
 
@@ -81,24 +137,15 @@ def generate_advanced_visualizations(output_dir, dist_file, representatives_file
 
     # 1. Load and filter distance matrix
     rep_set = set(extract_genome_name(line.strip()) for line in open(representatives_file) if line.strip())
-    with open(dist_file, 'r') as f:
-        header = f.readline().strip().split('\t')[1:]
-        indices = [i for i, h in enumerate(header) if extract_genome_name(h) in rep_set]
-        labels = [extract_genome_name(header[i]) for i in indices]
-        data = []
-        for line in f:
-            parts = line.strip().split('\t')
-            if extract_genome_name(parts[0]) in rep_set:
-                data.append([float(parts[i+1]) for i in indices])
-    
-    matrix_np = np.array(data)
+    labels, matrix_np = load_representative_matrix(dist_file, rep_set)
     n = len(labels)
 
     # 2. Hierarchical Clustering (UPGMA)
-    link = linkage(squareform(matrix_np, checks=False), method='average')
+    # Condensed float32 upper triangle straight from the symmetric matrix
+    link = linkage(matrix_np[np.triu_indices(n, k=1)], method='average')
     order = leaves_list(link)
     ordered_labels = [labels[i] for i in order]
-    matrix_ord = matrix_np[order, :][:, order]
+    matrix_ord = matrix_np[np.ix_(order, order)]
 
     # ---  COLOR SCALE  ---
     cs = [
@@ -112,27 +159,23 @@ def generate_advanced_visualizations(output_dir, dist_file, representatives_file
         [1.00, '#d73027']  # 0.10: Red
     ]
 
-    # --- 3) Prepare SciPy Dendrograms ---
-    # Top dendrogram
-    dtop = dendrogram(link, labels=ordered_labels, orientation='top', no_plot=True)
-    # Right dendrogram
-    dright = dendrogram(link, labels=ordered_labels, orientation='right', no_plot=True)
+    # --- 3) Prepare SciPy Dendrogram ---
+    # One traversal serves both sides: the right dendrogram reuses the
+    # top coordinates with the axes swapped.
+    dtree = dendrogram(link, no_plot=True)
 
     # SciPy leaf position scaling: leaves at 5,15,25,...,10*(n-1)+5
     # To map to 0..n-1: pos_scaled = (pos_leaf - 5) / 10
-    icoord_top = dtop['icoord']
-    dcoord_top = dtop['dcoord']
-    max_d = max(max(dc) for dc in dcoord_top)
-
-    icoord_r = dright['icoord']
-    dcoord_r = dright['dcoord']
+    icoord_all = dtree['icoord']
+    dcoord_all = dtree['dcoord']
+    max_d = max(max(dc) for dc in dcoord_all)
 
     # --- 4) Create Figure ---
     fig_hm = go.Figure()
     
     # Top Dendrogram
     top_traces = []
-    for icoord, dcoord in zip(icoord_top, dcoord_top):
+    for icoord, dcoord in zip(icoord_all, dcoord_all):
         xs = [(x - 5)/10 for x in icoord]  # scale 0..n-1
         ys = dcoord                         # cluster height
         top_traces.append(go.Scatter(
@@ -145,7 +188,7 @@ def generate_advanced_visualizations(output_dir, dist_file, representatives_file
 
     # Right Dendrogram
     right_traces = []
-    for icoord, dcoord in zip(icoord_r, dcoord_r):
+    for icoord, dcoord in zip(icoord_all, dcoord_all):
         # Key is to correctly invert Y coordinates
         ys = [(n-1) - (y - 5)/10 for y in icoord]  # inverted rows
         xs = dcoord                                 # distance
@@ -166,6 +209,8 @@ def generate_advanced_visualizations(output_dir, dist_file, representatives_file
         fig_hm.add_trace(tr.update(xaxis='x3', yaxis='y3'))
 
     # Central Heatmap
+    # z is the float32 matrix (half the HTML payload of float64), so the hover shows
+    # the real distance; integer codes would need a scaled hover label.
     fig_hm.add_trace(go.Heatmap(
         z=matrix_ord, 
         x=ordered_labels, 
@@ -261,8 +306,7 @@ def generate_advanced_visualizations(output_dir, dist_file, representatives_file
 
     # PCoA (MDS)
     try:
-        mds = MDS(n_components=2, dissimilarity='precomputed', random_state=42)
-        coords = mds.fit_transform(matrix_np)
+        coords = classical_mds(matrix_np)
         fig_pcoa = go.Figure(go.Scatter(
             x=coords[:, 0], y=coords[:, 1], mode='markers+text',
             text=labels, textposition="top center",
@@ -274,7 +318,7 @@ def generate_advanced_visualizations(output_dir, dist_file, representatives_file
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("input_dir", help="Directory with clustering_data.json")
+    parser.add_argument("input_dir", help="Directory with clustering.npz")
     parser.add_argument("-o", "--output-dir", required=True)
     args = parser.parse_args()
 
@@ -282,18 +326,20 @@ def main():
     out_dir = Path(args.output_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
     
-    json_path = in_dir / "clustering_data.json"
+    npz_path = in_dir / "clustering.npz"
     rep_txt = in_dir / "representatives.txt" 
     dist_txt = in_dir.parent / "2-distances" / "distances.txt"
+    if not dist_txt.exists() and dist_txt.with_suffix(".txt.gz").exists():
+        dist_txt = dist_txt.with_suffix(".txt.gz")
 
-    if not json_path.exists():
-        print(f"[ERROR] Not found: {json_path}")
+    if not npz_path.exists():
+        print(f"[ERROR] Not found: {npz_path}")
         sys.exit(1)
 
-    with open(json_path, 'r') as f:
-        data = json.load(f)
-        
-    create_plots(data, out_dir)
+    with np.load(npz_path) as clustering:
+        cluster_sizes = np.bincount(clustering['cluster_ids'])
+
+    create_plots(cluster_sizes, out_dir)
     generate_quicktree(out_dir, dist_txt, rep_txt)
     generate_advanced_visualizations(out_dir, dist_txt, rep_txt)
     print(f"\n[DONE] Files generated in: {out_dir}")
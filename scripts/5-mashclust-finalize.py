@@ -3,26 +3,125 @@
 Script 5: Finalize Results and Integrate with dataset-manager.py
 """
 import argparse
+import hashlib
+import importlib.util
 import shutil
 import re
 import os
+import random
 import sys
 import subprocess
+import threading
 import time
 import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 
+# NCBI request rate limits (requests/second), also the default download concurrency
+NCBI_RATE_NO_KEY = 3
+NCBI_RATE_WITH_KEY = 10
+# Concurrent in-process extractions (zlib releases the GIL while inflating)
+EXTRACT_WORKERS = os.cpu_count() or 1
+# Accessions per batched `datasets download --inputfile` call
+DOWNLOAD_BATCH = 200
+# Seconds without any download progress before `datasets` is killed
+DOWNLOAD_STALL_TIMEOUT = 120
+# Retry backoff: 2, 4, 8, ... seconds (+ up to 1 s jitter), capped; longer floor after HTTP 429
+RETRY_BACKOFF_CAP = 60
+RATE_LIMIT_BACKOFF = 30
+
+# Accession in a path or folder name; [_.] matches either separator before the version
+_ACC_RE = re.compile(r'(GC[FA])_(\d{9})[_.](\d+)')
+
 def normalize_accession(path_str):
     """
     Extracts GCA_000000000.1 from strings like paths or folder names.
     Returns None if no valid accession is found.
     """
-    pattern = r'(GC[FA])_(\d{9})[_.](\d+)'
-    match = re.search(pattern, path_str)
+    match = _ACC_RE.search(path_str)
     if match:
         return f"{match.group(1)}_{match.group(2)}.{match.group(3)}"
     return None
 
+class RateLimiter:
+    """
+    Token bucket shared by the download threads: at most `rate` requests
+    per second, with bursts of up to `rate` requests.
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = float(rate)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Empties the bucket so that no request is issued for `seconds` (e.g. after HTTP 429)"""
+        with self.lock:
+            # Refill up to now first, or the next acquire() would credit the idle time again
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+# Member every NCBI dataset archive must contain
+ZIP_CATALOG = "ncbi_dataset/data/dataset_catalog.json"
+# Fixed part of a ZIP local file header (bytes)
+ZIP_LOCAL_HEADER = 30
+# End-of-central-directory record: signature, fixed size, and its maximum distance from the end
+ZIP_EOCD_SIG = b'PK\x05\x06'
+ZIP_EOCD_SIZE = 22
+ZIP_EOCD_MAX_TAIL = ZIP_EOCD_SIZE + 0xFFFF
+
+def zip_structurally_ok(zip_path):
+    """
+    Cheap sanity check that reads only the central directory: the archive
+    opens, contains the dataset catalog, and every member's data fits inside
+    the file (catches truncated downloads). No member is decompressed.
+    """
+    if not zip_path.exists():
+        return False
+    try:
+        size = zip_path.stat().st_size
+        with zipfile.ZipFile(zip_path) as zf:
+            infos = zf.infolist()
+        if not any(zi.filename == ZIP_CATALOG for zi in infos):
+            return False
+        data_end = max(zi.header_offset + ZIP_LOCAL_HEADER + len(zi.filename.encode()) + zi.compress_size
+                       for zi in infos)
+        return data_end <= size
+    except Exception:
+        return False
+
+def zip_eocd_ok(zip_path):
+    """
+    O(1) tail check: the end-of-central-directory record is present and its
+    comment ends exactly at the end of the file (catches truncated downloads).
+    """
+    try:
+        size = zip_path.stat().st_size
+        with open(zip_path, 'rb') as fh:
+            fh.seek(max(0, size - ZIP_EOCD_MAX_TAIL))
+            tail = fh.read()
+    except OSError:
+        return False
+    pos = tail.rfind(ZIP_EOCD_SIG)
+    if pos < 0 or len(tail) - pos < ZIP_EOCD_SIZE:
+        return False
+    comment_len = int.from_bytes(tail[pos + 20:pos + 22], 'little')
+    return pos + ZIP_EOCD_SIZE + comment_len == len(tail)
+
 def check_zip_integrity(zip_path):
     """
     Validates if the ZIP file exists and passes the CRC-32 consistency check.
@@ -37,6 +136,202 @@ def check_zip_integrity(zip_path):
     except Exception:
         return False
 
+def zip_ledger_path(zip_path):
+    """Sidecar <name>.zip.ok sealing a verified download"""
+    return zip_path.with_name(zip_path.name + ".ok")
+
+def write_zip_ledger(zip_path):
+    """Records size and mtime of a verified ZIP in its .ok sidecar (one stat, no read)"""
+    st = zip_path.stat()
+    zip_ledger_path(zip_path).write_text(f"{st.st_size}\t{st.st_mtime_ns}\n")
+
+def zip_ledger_ok(zip_path):
+    """True if the ZIP was verified by a previous run and has not changed since (same size and mtime)"""
+    try:
+        size, mtime_ns = zip_ledger_path(zip_path).read_text().split('\t')
+        st = zip_path.stat()
+        return int(size) == st.st_size and int(mtime_ns) == st.st_mtime_ns
+    except (OSError, ValueError):
+        return False
+
+def read_dm_ledger(ledger_path):
+    """
+    kSNP index line recorded in <folder>.dm.ok by a previous successful
+    dataset-manager run, or None if missing or its genome file is gone.
+    """
+    try:
+        line = ledger_path.read_text().strip()
+    except OSError:
+        return None
+    if line and os.path.isfile(line.rpartition('\t')[2]):
+        return line
+    return None
+
+def run_watched(cmd, env, watch_path, stall_timeout=DOWNLOAD_STALL_TIMEOUT):
+    """
+    Runs `cmd` with stdout discarded and stderr piped (only its last 64 KiB are kept).
+    A watchdog kills the process when neither stderr output nor the size of
+    `watch_path` has changed for `stall_timeout` seconds.
+    Raises subprocess.CalledProcessError (with the stderr tail) on failure.
+    """
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env)
+    last_activity = [time.monotonic()]
+    tail = bytearray()
+
+    def drain():
+        for chunk in iter(lambda: proc.stderr.read1(4096), b''):
+            last_activity[0] = time.monotonic()
+            tail.extend(chunk)
+            del tail[:-65536]
+        proc.stderr.close()
+
+    reader = threading.Thread(target=drain, daemon=True)
+    reader.start()
+    size = None
+    stalled = False
+    try:
+        while True:
+            try:
+                proc.wait(timeout=1)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+            current = watch_path.stat().st_size if watch_path.exists() else None
+            if current != size:
+                size = current
+                last_activity[0] = time.monotonic()
+            if time.monotonic() - last_activity[0] > stall_timeout:
+                print(f"    [!] No download progress for {stall_timeout}s. Killing datasets...")
+                stalled = True
+                break
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+    # Children of a killed process may keep stderr open: don't wait for them
+    reader.join(timeout=5 if stalled else None)
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, stderr=tail.decode(errors='replace'))
+
+def download_genome(i, acc, zip_dest, datasets_exe, env, limiter, targets=None):
+    """
+    Downloads one accession with 5 retries. An existing ZIP only gets the
+    structural check; a new download also gets the EOCD tail check (`datasets`
+    already verifies CRCs), with a full CRC-32 pass only if that fails.
+    Member CRCs are checked while extracting: a genome that fails extraction
+    gets its ZIP (and .zip.ok) deleted and is downloaded again by main().
+    Every NCBI request waits for a token from the shared `limiter`.
+    `targets` replaces the accession on the command line (e.g. --inputfile for a batch).
+    Returns True if a valid ZIP is in place.
+    """
+    for attempt in range(1, 6): # 5 attempts
+        if attempt == 1 and (zip_ledger_ok(zip_dest) or zip_structurally_ok(zip_dest)):
+            print(f"[{i}] {acc} already exists and is valid.")
+            return True
+        if zip_dest.exists():
+            print(f"    [!] Corrupt ZIP detected for {acc}. Deleting and retrying...")
+            zip_dest.unlink()
+            zip_ledger_path(zip_dest).unlink(missing_ok=True)
+
+        print(f"[{i}] Downloading {acc} (Attempt {attempt}/5)...")
+        cmd_dl = [
+            datasets_exe, "download", "genome", "accession", *(targets or [acc]),
+            "--include", "genome,seq-report,cds,gff3", 
+            "--filename", str(zip_dest)
+        ]
+        try:
+            limiter.acquire()
+            run_watched(cmd_dl, env, zip_dest)
+            # Full CRC-32 pass only if the tail of a fresh archive looks wrong
+            if zip_structurally_ok(zip_dest) and (zip_eocd_ok(zip_dest) or check_zip_integrity(zip_dest)):
+                write_zip_ledger(zip_dest)
+                return True
+            rate_limited = False
+        except subprocess.CalledProcessError as e:
+            rate_limited = "429" in e.stderr or "Too Many Requests" in e.stderr
+        
+        if attempt < 5:
+            delay = min(RETRY_BACKOFF_CAP, 2 ** attempt) + random.uniform(0, 1)
+            if rate_limited:
+                # Throttled by NCBI: every worker backs off, not only this one
+                print(f"    [!] NCBI rate limit hit for {acc}. Backing off {RATE_LIMIT_BACKOFF}s...")
+                limiter.pause(RATE_LIMIT_BACKOFF)
+                delay = max(delay, RATE_LIMIT_BACKOFF)
+            time.sleep(delay)
+    return False
+
+def batch_paths(base_dir, accessions):
+    """Batch ZIP and accession-list paths, named after the batch content so reruns reuse them"""
+    digest = hashlib.sha1('\n'.join(accessions).encode()).hexdigest()[:12]
+    return base_dir / f"batch_{digest}.zip", base_dir / f"batch_{digest}.txt"
+
+def zip_metadata(dm, zip_path):
+    """
+    Catalog and assembly reports (by accession) of a batch ZIP, parsed once for
+    all of its assemblies. Returns (None, {}) if they cannot be read.
+    """
+    try:
+        return dm.read_batch_metadata(str(zip_path))
+    except Exception:
+        return None, {}
+
+def catalog_accessions(catalog):
+    """Set of assembly accessions listed in a dataset catalog"""
+    if not catalog:
+        return set()
+    return {a['accession'] for a in catalog.get('assemblies', []) if 'accession' in a}
+
+def load_dataset_manager(dm_script):
+    """Imports dataset-manager.py as a module (its hyphenated name cannot be imported directly)"""
+    spec = importlib.util.spec_from_file_location("dataset_manager", dm_script)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def run_dataset_manager(dm, zip_dest, uncompressed_root, acc=None, name=None, catalog=None, report=None):
+    """
+    Builds the uncompressed dataset of one ZIP in-process and returns its kSNP report line.
+    For a batch ZIP, `acc` selects the assembly and `name` the dataset folder; `catalog`
+    and `report` (from zip_metadata) spare each assembly a re-parse of the batch metadata.
+    """
+    with dm.DatasetManager(str(zip_dest), accession=acc, dirname=name,
+                           catalog=catalog, report=report) as dataset:
+        return dataset.build_dataset(output_path=str(uncompressed_root)) or ""
+
+def existing_report(dataset_path, acc):
+    """
+    Rebuilds the kSNP report line of a dataset already extracted by a previous
+    run from its organism_report.tsv (written last by dataset-manager).
+    Returns None if the dataset is missing or incomplete.
+    """
+    genome_path = os.path.normpath(f"{dataset_path}/GENOME_{acc.replace('.', '_')}.fna")
+    organism_file = os.path.join(dataset_path, "organism_report.tsv")
+    if not (os.path.isfile(organism_file) and os.path.isfile(genome_path) and os.path.getsize(genome_path) > 0):
+        return None
+    with open(organism_file, 'r') as f:
+        meta = dict(line.rstrip('\n').split('\t', 1) for line in f if '\t' in line)
+    try:
+        return '\t'.join([meta['genus'], meta['species'], meta['strain'], meta['tax-id'], genome_path])
+    except KeyError:
+        return None
+
+def load_previous_results(acc_file, ksnp_index_path):
+    """
+    Accessions and kSNP index lines (by folder name) already written by a
+    previous or interrupted run. Index lines whose genome file is gone are dropped.
+    """
+    done_accs, done_lines = set(), {}
+    if os.path.isfile(acc_file):
+        with open(acc_file, 'r') as f:
+            done_accs = set(f.read().split())
+    if os.path.isfile(ksnp_index_path):
+        with open(ksnp_index_path, 'r') as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if '\t' in line and os.path.isfile(line.rpartition('\t')[2]):
+                    done_lines[line.partition('\t')[0]] = line
+    return done_accs, done_lines
+
 def main():
     parser = argparse.ArgumentParser(description="Step 5: Finalize Results")
     parser.add_argument("--non-targets", required=True, help="List of non-target genome paths")
@@ -45,7 +340,12 @@ def main():
     parser.add_argument("--acc-file", required=True, help="Path for the selected_accessions.txt output")
     parser.add_argument("--dataset-manager", required=True, help="Absolute path to dataset-manager.py")
     parser.add_argument("--api-key", default=None, help="NCBI API Key for higher rate limits")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help=f"Concurrent downloads (default: {NCBI_RATE_NO_KEY}, {NCBI_RATE_WITH_KEY} with --api-key)")
+    parser.add_argument("--batch-size", type=int, default=DOWNLOAD_BATCH,
+                        help="Accessions per batched datasets download (0 or 1 disables batching)")
     args = parser.parse_args()
+    args.batch_size = max(1, args.batch_size)
 
     # Tool and path verification
     datasets_exe = shutil.which("datasets")
@@ -53,10 +353,16 @@ def main():
         print("[CRITICAL ERROR] 'datasets' binary not found in PATH.")
         sys.exit(1)
 
+    # Environment with API Key: built once, shared read-only by every download worker
+    env = os.environ.copy()
+    if args.api_key:
+        env['NCBI_API_KEY'] = args.api_key
+
     dm_script = Path(args.dataset_manager)
     if not dm_script.exists():
         print(f"[CRITICAL ERROR] dataset-manager.py not found at: {dm_script}")
         sys.exit(1)
+    dm = load_dataset_manager(dm_script)
 
     # Output directory setup
     base_dir = Path(args.out_dir) 
@@ -64,8 +370,8 @@ def main():
     base_dir.mkdir(parents=True, exist_ok=True)
     uncompressed_root.mkdir(parents=True, exist_ok=True)
 
-    # Collect genomes to process
-    selected_items = []
+    # Collect genomes to process (accession -> folder name; first occurrence wins)
+    selected_items = {}
     def collect(file_path):
         if not Path(file_path).exists(): return
         with open(file_path, 'r') as f:
@@ -73,9 +379,11 @@ def main():
                 path_str = line.strip()
                 if not path_str: continue
                 acc = normalize_accession(path_str)
-                folder_name = Path(path_str).parent.name if "/" in path_str else Path(path_str).name
-                if acc:
-                    selected_items.append((acc, folder_name))
+                if not acc: continue
+                # Parent folder name (plain string ops, no Path per line)
+                head, sep, tail = path_str.rstrip('/').rpartition('/')
+                folder_name = head.rpartition('/')[2] if sep else tail
+                selected_items.setdefault(acc, folder_name)
 
     collect(args.non_targets)
     collect(args.representatives)
@@ -89,72 +397,136 @@ def main():
     index_lines = [] 
     failed = 0
 
-    # Configure environment with API Key
-    env = os.environ.copy()
-    if args.api_key:
-        env['NCBI_API_KEY'] = args.api_key
+    # Results are appended line by line as genomes finish, so an interrupted
+    # run can resume from them; the files are rewritten sorted at the end
+    ksnp_index_path = Path(args.acc_file).parent / "ksnp_files_index.tsv"
+    done_accs, done_lines = load_previous_results(args.acc_file, ksnp_index_path)
+    acc_f = open(args.acc_file, 'a', buffering=1)
+    idx_f = open(ksnp_index_path, 'a', buffering=1)
 
-    for i, (acc, folder_name) in enumerate(selected_items, 1):
-        zip_dest = base_dir / f"{folder_name}.zip"
-        success_dl = False
-        
-        # DOWNLOAD LOOP WITH 5 RETRIES AND INTEGRITY CHECK
-        for attempt in range(1, 6): # 5 attempts
-            if check_zip_integrity(zip_dest):
-                success_dl = True
-                if attempt == 1: print(f"[{i}] {acc} already exists and is valid.")
-                break
-            else:
-                if zip_dest.exists():
-                    print(f"    [!] Corrupt ZIP detected (CRC-32 failure) for {acc}. Deleting and retrying...")
-                    zip_dest.unlink()
-
-                print(f"[{i}] Downloading {acc} (Attempt {attempt}/5)...")
-                cmd_dl = [
-                    datasets_exe, "download", "genome", "accession", acc, 
-                    "--include", "genome,seq-report,cds,gff3", 
-                    "--filename", str(zip_dest)
-                ]
-                try:
-                    subprocess.run(cmd_dl, check=True, capture_output=True, env=env)
-                    if check_zip_integrity(zip_dest):
-                        success_dl = True
-                        break
-                except subprocess.CalledProcessError:
-                    pass
-            
-            if attempt < 5:
-                time.sleep(2)
-
-        if not success_dl:
-            print(f"    [FATAL] NCBI download failed permanently for {acc} after 5 attempts.")
-            failed += 1
-            continue
-
-        # RUN DATASET-MANAGER.PY
-        print(f"    -> Running dataset-manager for extraction...")
-        cmd_dm = [
-            sys.executable, str(dm_script), 
-            "build-dataset", 
-            "--output", str(uncompressed_root),
-            str(zip_dest)
-        ]
+    def record(i, acc, index_line, journal=True):
+        index_lines.append((i, index_line))
+        final_accessions.append(acc)
+        if journal:
+            acc_f.write(f"{acc}\n")
+            idx_f.write(f"{index_line}\n")
 
-        try:
-            result = subprocess.run(cmd_dm, check=True, capture_output=True, text=True)
-            dm_output = result.stdout.strip()
-            
-            if dm_output:
-                index_lines.append(f"{folder_name}\t{dm_output}")
-                final_accessions.append(acc)
-                print("    [OK] Extracted successfully.")
+    # Requests/second allowed by NCBI; --jobs only bounds concurrency
+    rate = NCBI_RATE_WITH_KEY if args.api_key else NCBI_RATE_NO_KEY
+    jobs = max(1, args.jobs or rate)
+    limiter = RateLimiter(rate)
+    print(f"[INFO] Downloads: {jobs} concurrent, up to {rate} requests/s")
+
+    # Downloads run concurrently; each finished ZIP is handed straight to the
+    # extraction pool, so downloading and extraction overlap.
+    # downloads: future -> (zip, [(i, acc, folder_name), ...], is_batch)
+    with ThreadPoolExecutor(max_workers=jobs) as dl_pool, \
+         ThreadPoolExecutor(max_workers=EXTRACT_WORKERS) as dm_pool:
+        downloads = {}
+        to_batch = []
+
+        def submit_single(i, acc, folder_name):
+            zip_dest = base_dir / f"{folder_name}.zip"
+            fut = dl_pool.submit(download_genome, i, acc, zip_dest, datasets_exe, env, limiter)
+            downloads[fut] = (zip_dest, [(i, acc, folder_name)], False)
+
+        for i, (acc, folder_name) in enumerate(selected_items.items(), 1):
+            # Already in the output files of a previous/interrupted run
+            if acc in done_accs and folder_name in done_lines:
+                print(f"[{i}] {acc} already recorded. Skipping.")
+                record(i, acc, done_lines[folder_name], journal=False)
+                continue
+            # Extracted by a previous run: no download, no dataset-manager
+            report = (read_dm_ledger(base_dir / f"{folder_name}.dm.ok")
+                      or existing_report(uncompressed_root / folder_name, acc))
+            if report:
+                print(f"[{i}] {acc} already extracted. Skipping.")
+                record(i, acc, f"{folder_name}\t{report}")
+                continue
+            # A ZIP left by a previous single download is reused; the rest is batched
+            if args.batch_size > 1 and not (base_dir / f"{folder_name}.zip").exists():
+                to_batch.append((i, acc, folder_name))
             else:
-                print("    [!] dataset-manager returned no output.")
+                submit_single(i, acc, folder_name)
+
+        # One `datasets download --inputfile` call (one ZIP) per batch
+        for start in range(0, len(to_batch), args.batch_size):
+            batch = to_batch[start:start + args.batch_size]
+            if len(batch) == 1:
+                submit_single(*batch[0])
+                continue
+            batch_zip, list_file = batch_paths(base_dir, [acc for _, acc, _ in batch])
+            list_file.write_text(''.join(f"{acc}\n" for _, acc, _ in batch))
+            tag = f"B{start // args.batch_size + 1}"
+            fut = dl_pool.submit(download_genome, tag, f"batch of {len(batch)} accessions", batch_zip,
+                                 datasets_exe, env, limiter, ["--inputfile", str(list_file)])
+            downloads[fut] = (batch_zip, batch, True)
+
+        # extractions: future -> (i, acc, folder_name); an accession whose genome
+        # fails to extract (e.g. bad CRC) gets one fresh single download
+        extractions = {}
+        redownloaded = set()
+
+        def extraction_failed(i, acc, folder_name, reason):
+            nonlocal failed
+            # The single-download ZIP is never kept (or sealed) once its genome failed
+            zip_dest = base_dir / f"{folder_name}.zip"
+            zip_dest.unlink(missing_ok=True)
+            zip_ledger_path(zip_dest).unlink(missing_ok=True)
+            if acc in redownloaded:
+                print(f"    [!] [{i}] {reason}")
                 failed += 1
+                return
+            redownloaded.add(acc)
+            print(f"    [!] [{i}] {reason} Downloading {acc} again...")
+            submit_single(i, acc, folder_name)
 
-        except subprocess.CalledProcessError as e:
-            print(f"    [!] dataset-manager failed: {e.stderr}")
-            failed += 1
+        while downloads or extractions:
+            done, _ = wait([*downloads, *extractions], return_when=FIRST_COMPLETED)
+            for fut in done:
+                if fut in extractions:
+                    i, acc, folder_name = extractions.pop(fut)
+                    try:
+                        dm_output = fut.result()
+                    except Exception as e:
+                        extraction_failed(i, acc, folder_name, f"dataset-manager failed: {e}.")
+                        continue
+                    if dm_output:
+                        (base_dir / f"{folder_name}.dm.ok").write_text(f"{dm_output}\n")
+                        record(i, acc, f"{folder_name}\t{dm_output}")
+                        print(f"    [OK] [{i}] Extracted successfully.")
+                    else:
+                        extraction_failed(i, acc, folder_name, "dataset-manager returned no output.")
+                    continue
+
+                zip_dest, items, is_batch = downloads.pop(fut)
+                ok = fut.result()
+                present, catalog, reports = set(), None, {}
+                if is_batch:
+                    zip_dest.with_suffix(".txt").unlink(missing_ok=True)
+                    if ok:
+                        catalog, reports = zip_metadata(dm, zip_dest)
+                        present = catalog_accessions(catalog)
+
+                for i, acc, folder_name in items:
+                    if is_batch and acc not in present:
+                        # Failed batch or accession missing from it: fall back to a single download
+                        print(f"    [!] [{i}] {acc} not in batch download. Retrying individually...")
+                        submit_single(i, acc, folder_name)
+                        continue
+                    if not ok:
+                        print(f"    [FATAL] NCBI download failed permanently for {acc} after 5 attempts.")
+                        failed += 1
+                        continue
+
+                    # RUN DATASET-MANAGER.PY
+                    print(f"    -> [{i}] Running dataset-manager for extraction...")
+                    dm_args = (acc, folder_name, catalog, reports.get(acc)) if is_batch else ()
+                    fut_dm = dm_pool.submit(run_dataset_manager, dm, zip_dest, uncompressed_root, *dm_args)
+                    extractions[fut_dm] = (i, acc, folder_name)
+
+    acc_f.close()
+    idx_f.close()
 
     # Save final lists
     print(f"\n[INFO] Saving accession list to {args.acc_file}")
@@ -162,10 +534,9 @@ def main():
         for acc in sorted(list(set(final_accessions))):
             f.write(f"{acc}\n")
 
-    ksnp_index_path = Path(args.acc_file).parent / "ksnp_files_index.tsv"
     print(f"[INFO] Saving kSNP index to {ksnp_index_path}")
     with open(ksnp_index_path, 'w') as f:
-        for line in index_lines:
+        for _, line in sorted(index_lines):
             f.write(f"{line}\n")
 
     print(f"\n[DONE] Completed: {len(final_accessions)} | Failed: {failed}")
@@ -1,24 +1,74 @@
 #!/usr/bin/env python3
 from zipfile import ZipFile
-from textwrap import dedent
+from concurrent.futures import ThreadPoolExecutor
+import io
 import os
 import json
 import click
-import jsonlines
 import re
+import shutil
 import sys
+import threading
+
+# Characters removed from organism names
+_STRIP_RE = re.compile(r'[^a-zA-Z0-9-_ ]')
+# Members of one archive extracted concurrently (zlib releases the GIL)
+EXTRACT_THREADS = 4
+# Write size when streaming a member to disk
+COPY_BLOCK = 4 << 20
+# organism_report.tsv layout: genus, species, strain, tax-id, accession, genome file name
+_ORG_TMPL = 'genus\t{}\nspecies\t{}\nstrain\t{}\ntax-id\t{}\naccession\t{}\ngenome\t{}\n'
+# Metadata members shared by every assembly of a dataset ZIP
+CATALOG_MEMBER = 'ncbi_dataset/data/dataset_catalog.json'
+REPORT_MEMBER = 'ncbi_dataset/data/assembly_data_report.jsonl'
+
+def read_batch_metadata(file: str) -> tuple:
+    """
+    Parses the catalog and assembly report of a (multi-accession) dataset ZIP once.
+    Returns (catalog, {accession: report record}) to hand to each DatasetManager.
+    """
+    with ZipFile(file, 'r') as zf:
+        with zf.open(CATALOG_MEMBER) as fp:
+            catalog = json.load(io.TextIOWrapper(fp, encoding='utf-8'))
+        with zf.open(REPORT_MEMBER) as fp:
+            records = [json.loads(line) for line in io.TextIOWrapper(fp, encoding='utf-8') if line.strip()]
+    return catalog, {r['accession']: r for r in records if 'accession' in r}
 
 class DatasetManager:
     """
     Class to manage and extract data from NCBI genome dataset ZIP files.
     """
-    def __init__(self, file: str) -> None:
+    def __init__(self, file: str, accession: str = None, dirname: str = None,
+                 catalog: dict = None, report: dict = None) -> None:
         self.file: str = file
+        # Assembly to use in a multi-accession (batch) archive; default: the first one
+        self.requested_accession: str = accession
+        self.dirname: str = dirname
         self.root_path : str = 'ncbi_dataset/data/'
         self.directory : str = os.path.dirname(self.file)
         self.filename : str = os.path.basename(self.file)
-        self.catalog : dict = self.get_catalog()
-        self.assembly_report: list = self.get_assembly_report()
+        # One handle for the whole lifetime: the central directory is parsed once
+        self._zf : ZipFile = ZipFile(self.file, 'r')
+        # Member names, for membership checks without a KeyError round-trip
+        self._names : frozenset = frozenset(zi.filename for zi in self._zf.infolist())
+        # Extra handles for extraction threads: a ZipFile cursor is not shared across threads
+        self._local = threading.local()
+        self._thread_handles : list = []
+        self._handles_lock = threading.Lock()
+        try:
+            self._load_metadata(catalog, report)
+        except Exception:
+            self._zf.close()
+            raise
+
+    def _load_metadata(self, catalog: dict = None, report: dict = None) -> None:
+        """
+        Reads catalog and assembly report and derives the genome metadata.
+        A catalog / report record already parsed by read_batch_metadata is used as is.
+        """
+        self.catalog : dict = catalog if catalog is not None else self.get_catalog()
+        self.assembly_entry : dict = self.get_assembly_entry()
+        self.assembly_report: list = [report] if report is not None else self.get_assembly_report()
         self.genome_path : str = self.get_genome_filepath()
         self.accession : str = self.get_accession()
         self.corrected_accession = self.accession.replace('.', '_')  
@@ -27,11 +77,38 @@ class DatasetManager:
         self.genus: str = self.species.split(' ')[0]
         self.strain: str = self.get_strain()
         self.tax_id: str = self.assembly_report[0]['organism']['taxId']
-    
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Closes the cached ZIP handle and any per-thread handles."""
+        with self._handles_lock:
+            for zf in self._thread_handles:
+                zf.close()
+            self._thread_handles.clear()
+        self._zf.close()
+
+    def _thread_zip(self) -> ZipFile:
+        """ZipFile handle owned by the calling thread (opened on first use)."""
+        zf = getattr(self._local, 'zf', None)
+        if zf is None:
+            zf = ZipFile(self.file, 'r')
+            self._local.zf = zf
+            with self._handles_lock:
+                self._thread_handles.append(zf)
+        return zf
+
+    def has(self, name: str)-> bool:
+        """True if `name` is a member of the archive."""
+        return name in self._names
+
     def unzip(self)-> None:
         """Extracts the entire dataset content."""
-        with ZipFile(self.file, 'r') as file: 
-            file.extractall(path = self.directory)
+        self._zf.extractall(path = self.directory)
     
     def get_species_name(self):
         """Retrieves and normalizes the organism name from the assembly report."""
@@ -40,7 +117,7 @@ class DatasetManager:
 
     def normalize_string(self, string: str)-> str:
         """Removes special characters and cleans the species name."""
-        result = re.sub(r'[^a-zA-Z0-9-_ ]', '', string)
+        result = _STRIP_RE.sub('', string)
         return self.remove_strain_from_species(result)
     
     def remove_strain_from_species(self, species: str)-> str:
@@ -55,35 +132,46 @@ class DatasetManager:
         """Extracts a single file from the ZIP archive. Robust against null paths."""
         if file is None:
             return
-            
+        if not self.has(file):
+            print(f"Warning: Could not extract {file} from {self.filename}: not in archive", file=sys.stderr)
+            return
+
         output_path = output if output != None else self.directory
         filename = os.path.basename(file) if filename == None else filename
         
         if not os.path.exists(output_path):
             os.makedirs(output_path)
             
-        with ZipFile(self.file) as z:
-            try:
-                with open(os.path.join(output_path, filename), 'wb') as f:
-                    f.write(z.read(file))
-            except (KeyError, Exception) as e:
-                # Extraction errors are sent to stderr to avoid breaking the kSNP index on stdout
-                print(f"Warning: Could not extract {file} from {self.filename}: {e}", file=sys.stderr)
+        try:
+            self._copy_member(file, os.path.join(output_path, filename))
+        except (KeyError, Exception) as e:
+            # Extraction errors are sent to stderr to avoid breaking the kSNP index on stdout
+            print(f"Warning: Could not extract {file} from {self.filename}: {e}", file=sys.stderr)
     
+    def _copy_member(self, member, dest: str, zf: ZipFile = None)-> None:
+        """Streams one ZIP member to `dest` in COPY_BLOCK writes (never holds the whole file in memory)."""
+        zf = zf if zf is not None else self._zf
+        with zf.open(member) as src, open(dest, 'wb') as dst:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(dst.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            try:
+                shutil.copyfileobj(src, dst, length=COPY_BLOCK)
+            except Exception:
+                # Never leave a partly written member behind
+                dst.close()
+                os.remove(dest)
+                raise
+
     def load_zipped_file(self, file_inside_zip: str)-> list:
         """Returns the content of a file located inside the ZIP archive."""
-        with ZipFile(self.file) as myzip:
-            with myzip.open(file_inside_zip) as myfile:
-                result = myfile.readlines()
-                return list(result)
+        with self._zf.open(file_inside_zip) as myfile:
+            result = myfile.readlines()
+            return list(result)
     
     def load_zipped_jsonlines(self, file_inside_zip)-> list:
         """Returns a list of dictionaries from an internal JSONL file."""
-        bytes_content = self.load_zipped_file(file_inside_zip)
-        result = []
-        for line in jsonlines.Reader(bytes_content):
-            result.append(line)
-        return result
+        with self._zf.open(file_inside_zip) as fp:
+            return [json.loads(line) for line in io.TextIOWrapper(fp, encoding='utf-8') if line.strip()]
 
     def get_filepath(self, file_type: str)-> str:
         """Retrieves the internal path for a file type based on the catalog."""
@@ -94,7 +182,7 @@ class DatasetManager:
             'REPORT':'SEQUENCE_REPORT'
         }
         try:
-            files = self.catalog['assemblies'][1]['files']
+            files = self.assembly_entry['files']
             for f in files:
                 if f['fileType'] == legend[file_type]:
                     path = f['filePath']
@@ -105,14 +193,26 @@ class DatasetManager:
 
     def get_catalog(self)-> dict:
         """Parses the dataset_catalog.json file."""
-        bytes_content = self.load_zipped_file(self.root_path + 'dataset_catalog.json')
-        result = json.loads(''.join([i.decode('utf-8') for i in bytes_content]))
-        return result
+        with self._zf.open(CATALOG_MEMBER) as fp:
+            return json.load(io.TextIOWrapper(fp, encoding='utf-8'))
     
+    def get_assembly_entry(self)-> dict:
+        """Catalog entry of the requested assembly (the first assembly if none was requested)."""
+        if self.requested_accession is None:
+            return self.catalog['assemblies'][1]
+        for assembly in self.catalog['assemblies']:
+            if assembly.get('accession') == self.requested_accession:
+                return assembly
+        raise KeyError(f"{self.requested_accession} not found in {self.filename}")
+
     def get_assembly_report(self)-> list:
-        """Parses the assembly_data_report.jsonl file."""
-        path = self.root_path + 'assembly_data_report.jsonl'
-        return self.load_zipped_jsonlines(path)
+        """Parses the assembly_data_report.jsonl file; only the requested assembly's record if one was requested."""
+        report = self.load_zipped_jsonlines(REPORT_MEMBER)
+        if self.requested_accession is not None:
+            report = [r for r in report if r.get('accession') == self.requested_accession]
+            if not report:
+                raise KeyError(f"{self.requested_accession} not found in the assembly report of {self.filename}")
+        return report
         
     def get_genome_filepath(self)-> str:
         return self.get_filepath(file_type='GENOME')
@@ -124,7 +224,7 @@ class DatasetManager:
         return self.get_filepath(file_type='CDS')
 
     def get_accession(self)-> str:
-        return self.catalog['assemblies'][1]['accession']
+        return self.assembly_entry['accession']
     
     def get_strain(self)->str:
         """Extracts strain name if available, otherwise returns 'NA'."""
@@ -136,7 +236,14 @@ class DatasetManager:
 
     def extract_assembly_report(self, output_path = None)-> None:
         path_to_report = self.root_path + 'assembly_data_report.jsonl'
-        self.unzip_file(path_to_report, output_path)
+        if self.requested_accession is None:
+            self.unzip_file(path_to_report, output_path)
+            return
+        # Batch archive: keep only this assembly's record
+        output_path = output_path if output_path != None else self.directory
+        os.makedirs(output_path, exist_ok=True)
+        with open(os.path.join(output_path, os.path.basename(path_to_report)), 'w') as f:
+            f.write(json.dumps(self.assembly_report[0]) + '\n')
     
     def extract_genome(self, output_path = None)-> None:
         filename = f'GENOME_{self.corrected_accession}{self.genome_extension}'
@@ -153,61 +260,103 @@ class DatasetManager:
             filename = 'genomic.gff'
             self.unzip_file(path_to_gff, output_path, filename)
 
+    def _extract_many(self, plan: dict)-> None:
+        """
+        Extracts several members of the archive concurrently, one thread-local ZipFile per thread.
+        `plan` maps internal ZIP path -> (output_dir, output_filename).
+        """
+        for missing in [name for name in plan if not self.has(name)]:
+            print(f"Warning: Could not extract {missing} from {self.filename}: not in archive", file=sys.stderr)
+        members = [self._zf.getinfo(name) for name in plan if self.has(name)]
+
+        threaded = len(members) > 1
+
+        def extract(zi):
+            output_dir, filename = plan[zi.filename]
+            os.makedirs(output_dir, exist_ok=True)
+            try:
+                zf = self._thread_zip() if threaded else self._zf
+                self._copy_member(zi, os.path.join(output_dir, filename), zf)
+            except Exception as e:
+                print(f"Warning: Could not extract {zi.filename} from {self.filename}: {e}", file=sys.stderr)
+
+        if not threaded:
+            for zi in members:
+                extract(zi)
+            return
+        with ThreadPoolExecutor(max_workers=min(EXTRACT_THREADS, len(members))) as ex:
+            list(ex.map(extract, members))
+
     def build_dataset_dirname(self):
-        return self.filename
+        """Dataset folder name: the requested one, else the ZIP name without extension."""
+        return self.dirname if self.dirname else os.path.splitext(self.filename)[0]
 
     def save_organism_file(self, filename)-> None:
         """Saves metadata to a TSV file for record keeping."""
-        content = dedent(f'''\
-            genus\t{self.genus}
-            species\t{self.species}
-            strain\t{self.strain}
-            tax-id\t{self.tax_id}
-            accession\t{self.accession}
-            genome\tGENOME_{self.corrected_accession}{self.genome_extension}
-        ''')
-        with open(filename, mode='w') as file:
-            file.write(content)
-
-    def build_dataset(self, output_path = None)-> None:
+        content = _ORG_TMPL.format(self.genus, self.species, self.strain, self.tax_id, self.accession,
+                                   f'GENOME_{self.corrected_accession}{self.genome_extension}')
+        # A few hundred bytes: one unbuffered write, no text I/O layer
+        fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(fd, content.encode('utf-8'))
+        finally:
+            os.close(fd)
+
+    def build_dataset(self, output_path = None)-> str:
         """
         Orchestrates the uncompressed dataset construction.
-        Outputs a tab-separated report for kSNP to stdout.
+        Returns the tab-separated report line for kSNP, or None if the genome file is missing
+        or empty after extraction (so no ledger or index line points at it).
         """
         output = output_path if output_path != None else self.directory
         dirname = self.build_dataset_dirname()
-        dataset_path = os.path.join(output, os.path.splitext(dirname)[0])
-        
-        # 1. Extract Genome (High Priority)
+        dataset_path = os.path.join(output, dirname)
+        genome_type = 'GENOME'
+        genome_path = os.path.normpath(
+            f'{dataset_path}/{genome_type}_{self.corrected_accession}{self.genome_extension}'
+        )
+        report = [self.genus, self.species, self.strain, str(self.tax_id), genome_path]
+
+        # 0. Already built by a previous run (organism_report.tsv is written last)
+        organism_filepath = os.path.join(dataset_path, 'organism_report.tsv')
+        if os.path.isfile(organism_filepath) and os.path.isfile(genome_path) and os.path.getsize(genome_path) > 0:
+            return '\t'.join(report)
+
+        # 1. Genome, CDS, GFF and assembly report, extracted concurrently
+        plan = {
+            self.genome_path: (dataset_path, f'{genome_type}_{self.corrected_accession}{self.genome_extension}'),
+            self.get_CDS_filepath(): (dataset_path, f'CDS_{self.corrected_accession}{self.genome_extension}'),
+            self.get_gff_filepath(): (dataset_path, 'genomic.gff'),
+        }
+        if self.requested_accession is None:
+            plan[self.root_path + 'assembly_data_report.jsonl'] = (dataset_path, 'assembly_data_report.jsonl')
+        plan.pop(None, None)
+        # Optional members (CDS, GFF) absent from the archive are skipped without a warning
+        plan = {name: dest for name, dest in plan.items()
+                if name == self.genome_path or self.has(name)}
         try:
-            self.extract_genome(output_path = dataset_path)
+            os.makedirs(dataset_path, exist_ok=True)
+            self._extract_many(plan)
         except Exception as e:
             print(f"Fatal error extracting genome {self.filename}: {e}", file=sys.stderr)
-            return
+            return None
+        # _extract_many only warns per member: no genome file, no report line
+        if not (os.path.isfile(genome_path) and os.path.getsize(genome_path) > 0):
+            print(f"Fatal error extracting genome {self.filename}: {self.genome_path} not extracted", file=sys.stderr)
+            return None
 
-        # 2. Secondary extractions (Non-blocking)
-        try: self.extract_CDS(output_path = dataset_path)
-        except: pass
-        
-        try: self.extract_assembly_report(output_path = dataset_path)
-        except: pass
-        
-        try: self.extract_gff(output_path = dataset_path)
-        except: pass
+        # 2. Batch archive: this assembly's record only (Non-blocking)
+        if self.requested_accession is not None:
+            try: self.extract_assembly_report(output_path = dataset_path)
+            except: pass
 
         # 3. Save Metadata
         try:
-            organism_filepath = os.path.join(dataset_path, 'organism_report.tsv')
             self.save_organism_file(organism_filepath)
         except: pass
 
-        # 4. Final report for kSNP index (Stdout)
-        genome_type = 'GENOME'
-        genome_path = os.path.normpath(
-            f'{dataset_path}/{genome_type}_{self.corrected_accession}{self.genome_extension}'
-        )
-        report = [self.genus, self.species, self.strain, str(self.tax_id), genome_path]
-        click.echo('\t'.join(report))
+        # 4. Final report for kSNP index
+        return '\t'.join(report)
 
 # CLI Configuration
 @click.group()
@@ -217,18 +366,24 @@ def cli():
 @cli.command()
 @click.argument('ncbi_dataset')
 @click.option('--output', default = None, help = 'Output path for FASTA files')
-def extract_fasta(ncbi_dataset: str, output: str)-> None:
+@click.option('--accession', default = None, help = 'Assembly to extract from a multi-accession ZIP')
+def extract_fasta(ncbi_dataset: str, output: str, accession: str)-> None:
     """Extracts only the genomic FASTA file."""
-    dataset = DatasetManager(ncbi_dataset)
-    dataset.extract_genome(output_path = output)
+    with DatasetManager(ncbi_dataset, accession = accession) as dataset:
+        dataset.extract_genome(output_path = output)
 
 @cli.command()
 @click.argument('ncbi_dataset')
 @click.option('--output', default = None, help = 'Directory to build the uncompressed dataset')
-def build_dataset(ncbi_dataset: str, output: str)-> None:
+@click.option('--accession', default = None, help = 'Assembly to extract from a multi-accession ZIP')
+@click.option('--name', default = None, help = 'Dataset folder name (default: ZIP name without extension)')
+def build_dataset(ncbi_dataset: str, output: str, accession: str, name: str)-> None:
     """Extracts all relevant files and prints the metadata report."""
-    dataset = DatasetManager(ncbi_dataset)
-    dataset.build_dataset(output_path = output)
+    with DatasetManager(ncbi_dataset, accession = accession, dirname = name) as dataset:
+        report = dataset.build_dataset(output_path = output)
+    # Report on stdout for the kSNP index
+    if report:
+        click.echo(report)
 
 if __name__ == '__main__':
     cli()
\ No newline at end of file